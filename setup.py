@@ -3,5 +3,5 @@ from setuptools import setup
 setup(
     name="vq-voice-swap",
     py_modules=["vq_voice_swap"],
-    install_requires=["numpy", "torch", "torchaudio", "tqdm"],
+    install_requires=["numpy", "torch>=2.3", "torchaudio", "tqdm"],
 )
@@ -11,6 +11,7 @@ import torch
 from tqdm.auto import tqdm
 
 from vq_voice_swap.dataset import ChunkReader
+from vq_voice_swap.diffusion import mse_per_sample
 from vq_voice_swap.vq_vae import VQVAE
 
 
@@ -85,7 +86,8 @@ def evaluate_losses(
         encoded_mb = encoded.repeat(len(ts_mb), 1, 1)
         targets_mb = targets.repeat(len(ts_mb), 1, 1)
 
-        sub_results = []
+        # Average over seeds with a running sum rather than stacking.
+        mean_mses = 0.0
         for epsilon in epsilons:
             epsilon_mb = epsilon.repeat(len(ts_mb), 1, 1)
             noised_inputs = model.diffusion.sample_q(
@@ -95,10 +97,9 @@ def evaluate_losses(
                 predictions = model.predictor(
                     noised_inputs, ts_mb, cond=encoded_mb, labels=labels_mb
                 )
-                mses = ((predictions - epsilon_mb) ** 2).flatten(1).mean(1)
-                sub_results.append(mses)
+                mean_mses = mean_mses + mse_per_sample(predictions, epsilon_mb)
 
-        results.append(torch.stack(sub_results).mean(0))
+        results.append(mean_mses / len(epsilons))
 
     return torch.cat(results)
 
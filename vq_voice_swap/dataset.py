@@ -4,13 +4,19 @@ import subprocess
 from typing import Dict, Optional, Tuple, Union
 
 import numpy as np
-from torch.utils.data import DataLoader, Dataset
+from torch.utils.data import DataLoader, Dataset, DistributedSampler
 
 DURATION_ESTIMATE_SLACK = 0.05
 
 
 def create_data_loader(
-    directory: str, batch_size: int, encoding="linear", num_workers=4, **dataset_kwargs
+    directory: str,
+    batch_size: int,
+    encoding="linear",
+    num_workers=4,
+    pin_memory=False,
+    distributed=False,
+    **dataset_kwargs,
 ) -> Tuple[DataLoader, int]:
     """
     Create an audio data loader, either from LibriSpeech or from a small
@@ -18,13 +24,17 @@ def create_data_loader(
 
     Returned batches are dicts containing at least two keys:
         - 'label' (int): the speaker ID.
-        - 'samples' (tensor): an [N x T] batch of samples.
+        - 'samples' (tensor): an [N x T] float32 batch of samples.
 
     :param directory: the LibriSpeech data directory, or "tones" to use a
                       placeholder dataset.
     :param batch_size: the number of samples per batch.
     :param encoding: the audio encoding, "linear" or "ulaw".
     :param num_workers: number of parallel data loading threads.
+    :param pin_memory: if True, return batches in page-locked memory for
+                       faster (and asynchronous) copies to the GPU.
+    :param distributed: if True, only load this process's shard of the data
+                        for distributed training.
     :return: a pair (loader, num_labels), where loader is the DataLoader and
              num_labels is one greater than the maximum label index.
     """
@@ -32,13 +42,20 @@ def create_data_loader(
         dataset = ToneDataset(encoding=encoding)
     else:
         dataset = LibriSpeech(directory, encoding=encoding, **dataset_kwargs)
+    sampler = None
+    if distributed:
+        sampler = DistributedSampler(dataset, shuffle=True, drop_last=True)
     return (
         DataLoader(
             dataset,
             batch_size=batch_size,
-            shuffle=True,
+            shuffle=sampler is None,
+            sampler=sampler,
             num_workers=num_workers,
             drop_last=True,
+            pin_memory=pin_memory,
+            # Don't re-create the worker pool on every pass over the data.
+            persistent_workers=num_workers > 0,
         ),
         len(dataset.speaker_ids),
     )
@@ -105,7 +122,8 @@ class LibriSpeech(Dataset):
             num_samples = int(self.sample_rate * self.window_duration)
             samples = reader.read(num_samples)
             samples = np.pad(samples, (0, num_samples - len(samples)))
-            return {"label": datum.label, "samples": samples}
+            # Cast in the worker, since u-law encoding may promote to float64.
+            return {"label": datum.label, "samples": samples.astype(np.float32)}
         finally:
             reader.close()
 
@@ -147,7 +165,7 @@ class ToneDataset(Dataset):
 
         return {
             "label": speaker,
-            "samples": samples,
+            "samples": samples.astype(np.float32),
         }
 
 
@@ -1,5 +1,12 @@
-from .diffusion import Diffusion
+from .diffusion import Diffusion, mse_per_sample
 from .make import make_schedule
 from .schedule import CosSchedule, ExpSchedule, Schedule
 
-__all__ = ["Diffusion", "make_schedule", "CosSchedule", "Schedule", "ExpSchedule"]
+__all__ = [
+    "Diffusion",
+    "mse_per_sample",
+    "make_schedule",
+    "CosSchedule",
+    "Schedule",
+    "ExpSchedule",
+]
@@ -112,7 +112,7 @@ class Diffusion:
             its = tqdm(its)
 
         for i, t in its:
-            ts = torch.tensor([t] * x_T.shape[0]).to(x_T)
+            ts = torch.full((x_T.shape[0],), t, dtype=x_T.dtype, device=x_T.device)
             if schedule is not None:
                 t_step = schedule(ts) - schedule(ts - 1 / steps)
                 ts = schedule(ts)
@@ -148,10 +148,28 @@ class Diffusion:
             noise = torch.randn_like(x)
         samples = self.sample_q(x, ts, epsilon=noise)
         noise_pred = predictor(samples, ts)
-        return ((noise - noise_pred) ** 2).flatten(1).mean(dim=1)
+        return mse_per_sample(noise_pred, noise)
+
+
+@torch.jit.script
+def mse_per_sample(predictions: torch.Tensor, targets: torch.Tensor) -> torch.Tensor:
+    """
+    Compute the mean squared error for each batch element, in float32.
+
+    This is scripted so that the elementwise ops can be fused into a single
+    kernel instead of materializing the difference and its square.
+    """
+    diff = predictions.float() - targets.float()
+    return (diff * diff).flatten(1).mean(1)
 
 
 def broadcast_as(ts: torch.Tensor, tensor: torch.Tensor) -> torch.Tensor:
+    """
+    Reshape per-batch values so that they broadcast against tensor.
+
+    The result is not expanded to the full shape of tensor, so that schedule
+    math is done once per batch element rather than once per sample.
+    """
     while len(ts.shape) < len(tensor.shape):
         ts = ts[:, None]
-    return ts.to(tensor) + torch.zeros_like(tensor)
+    return ts.to(tensor)
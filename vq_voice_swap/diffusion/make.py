@@ -1,13 +1,15 @@
 from .schedule import CosSchedule, ExpSchedule, Schedule
 
+SCHEDULES = {
+    "exp": ExpSchedule,
+    "cos": CosSchedule,
+}
+
 
 def make_schedule(name: str) -> Schedule:
     """
     Create a schedule from a human-readable name.
     """
-    if name == "exp":
-        return ExpSchedule()
-    elif name == "cos":
-        return CosSchedule()
-    else:
+    if name not in SCHEDULES:
         raise ValueError(f"unknown schedule: {name}")
+    return SCHEDULES[name]()
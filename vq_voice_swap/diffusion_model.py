@@ -47,6 +47,13 @@ class DiffusionModel(Savable):
         self.predictor.add_labels(n, end=end)
         self.num_labels += n
 
+    @property
+    def downsample_rate(self) -> int:
+        """
+        Get the minimum divisor required for input sequences.
+        """
+        return self.predictor.downsample_rate
+
     def save_kwargs(self) -> Dict[str, Any]:
         return dict(
             pred_name=self.pred_name,
@@ -1,8 +1,12 @@
-from typing import Any, Dict, Iterator, TextIO, Tuple, Union
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Tuple, Union
 
 # The log line indicating that a checkpoint was saved.
 SAVED_MSG = "# saved\n"
 
+# The prefix of a log line indicating that the checkpoint of a given step was
+# saved, which may be logged after later steps.
+SAVED_STEP_PREFIX = "# saved step "
+
 
 def read_log(log_reader: Union[str, TextIO]) -> Iterator[Tuple[int, Dict[str, Any]]]:
     """
@@ -45,7 +49,8 @@ class Logger:
     well as optional markers whenever checkpoints were saved to a file.
 
     The log can be resumed, in which case it is automatically truncated to the
-    last save (or not truncated, if no saves are marked).
+    last save (or not truncated, if no saves are marked). If the save marker
+    records a step, steps logged after that step are dropped as well.
     To access the step of the first log message from a resume, look at the
     start_step attribute.
     """
@@ -58,13 +63,11 @@ class Logger:
 
             # The log may not include a save due to legacy code, but if
             # it does, we should truncate to it.
-            if SAVED_MSG in all_lines:
-                keep_lines = len(all_lines) - all_lines[::-1].index(SAVED_MSG)
-                all_lines = all_lines[:keep_lines]
+            all_lines = _truncate_to_save(all_lines)
 
             step_lines = [x for x in all_lines if x.startswith("step ")]
             if len(step_lines):
-                self.start_step = int(step_lines[-1].split(" ")[1].split(":")[0])
+                self.start_step = _line_step(step_lines[-1])
 
             # Re-write the (possibly truncated) log.
             self.out_file = open(out_filename, "w+")
@@ -76,13 +79,42 @@ class Logger:
     def log(self, step: int, **kwargs):
         fields = " ".join(f"{k}={v:.05f}" for k, v in kwargs.items())
         log_line = f"step {step + self.start_step}: {fields}"
-        self.out_file.write(log_line + "\n")
-        self.out_file.flush()
+        self._write(log_line + "\n")
         print(log_line)
 
-    def mark_save(self):
-        self.out_file.write(SAVED_MSG)
-        self.out_file.flush()
+    def mark_save(self, step: Optional[int] = None):
+        """
+        Mark that a checkpoint was saved.
+
+        :param step: the (absolute) step that the checkpoint was saved at, if
+                     steps may have been logged since it was taken.
+        """
+        if step is None:
+            self._write(SAVED_MSG)
+        else:
+            self._write(f"{SAVED_STEP_PREFIX}{step}\n")
 
     def close(self):
         self.out_file.close()
+
+    def _write(self, text: str):
+        self.out_file.write(text)
+        self.out_file.flush()
+
+
+def _truncate_to_save(lines: List[str]) -> List[str]:
+    for i in range(len(lines) - 1, -1, -1):
+        if lines[i] == SAVED_MSG:
+            return lines[: i + 1]
+        elif lines[i].startswith(SAVED_STEP_PREFIX):
+            saved_step = int(lines[i][len(SAVED_STEP_PREFIX) :])
+            return [
+                x
+                for x in lines[: i + 1]
+                if not x.startswith("step ") or _line_step(x) <= saved_step
+            ]
+    return lines
+
+
+def _line_step(line: str) -> int:
+    return int(line.split(" ")[1].split(":")[0])
@@ -0,0 +1,37 @@
+import os
+
+from .logger import Logger, read_log
+
+
+def test_logger_resume_saved_step(tmp_path):
+    path = os.path.join(tmp_path, "train.log")
+    logger = Logger(path)
+    logger.log(1, loss=1.0)
+    logger.log(2, loss=2.0)
+    logger.log(3, loss=3.0)
+    # The save of step 2 finishes after step 3 was logged.
+    logger.mark_save(2)
+    logger.log(4, loss=4.0)
+    logger.close()
+
+    logger = Logger(path, resume=True)
+    assert logger.start_step == 2
+    logger.log(1, loss=5.0)
+    logger.close()
+
+    steps = [(step, kvs["loss"]) for step, kvs in read_log(path)]
+    assert steps == [(1, 1.0), (2, 2.0), (3, 5.0)]
+
+
+def test_logger_resume_legacy_save(tmp_path):
+    path = os.path.join(tmp_path, "train.log")
+    logger = Logger(path)
+    logger.log(1, loss=1.0)
+    logger.mark_save()
+    logger.log(2, loss=2.0)
+    logger.close()
+
+    logger = Logger(path, resume=True)
+    assert logger.start_step == 1
+    logger.close()
+    assert [step for step, _ in read_log(path)] == [1]
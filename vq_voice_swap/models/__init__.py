@@ -1,4 +1,4 @@
-from .base import Predictor, Savable, atomic_save
+from .base import Predictor, Savable, atomic_save, state_to_cpu
 from .classifier import Classifier, ClassifierStem
 from .conv_encoder import ConvMFCCEncoder
 from .encoder_predictor import EncoderPredictor
@@ -10,6 +10,7 @@ __all__ = [
     "Predictor",
     "Savable",
     "atomic_save",
+    "state_to_cpu",
     "Classifier",
     "ClassifierStem",
     "ConvMFCCEncoder",
@@ -17,6 +17,13 @@ class Predictor(nn.Module):
         """
 
     def condition(self, **kwargs) -> Callable:
+        """
+        Bind keyword arguments to get a function of (xs, ts).
+
+        Subclasses may precompute anything that only depends on the bound
+        arguments (e.g. a projection of cond), so that it is not recomputed
+        at every diffusion step.
+        """
         return functools.partial(self, **kwargs)
 
     @abstractmethod
@@ -127,6 +134,20 @@ class Savable(nn.Module):
         return total
 
 
+def state_to_cpu(state: Any) -> Any:
+    """
+    Recursively copy every Tensor in a (possibly nested) state to the CPU,
+    so that the result is unaffected by further updates to the source.
+    """
+    if isinstance(state, torch.Tensor):
+        return state.detach().to("cpu", copy=True)
+    elif isinstance(state, dict):
+        return {k: state_to_cpu(v) for k, v in state.items()}
+    elif isinstance(state, (list, tuple)):
+        return type(state)(state_to_cpu(x) for x in state)
+    return state
+
+
 def atomic_save(state: Any, path: str):
     with tempfile.TemporaryDirectory() as tmp_dir:
         tmp_file = os.path.join(tmp_dir, "out.pt")
@@ -115,7 +115,7 @@ class ClassifierStem(nn.Module):
         h = self.in_conv(x)
         for block in self.blocks:
             if use_checkpoint:
-                h = checkpoint(block, h, emb)
+                h = checkpoint(block, h, emb, use_reentrant=False)
             else:
                 h = block(h, emb)
         return self.out(h)
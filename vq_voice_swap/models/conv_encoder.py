@@ -98,8 +98,8 @@ class ConvMFCCEncoder(Encoder):
         accel = deltas(deriv)
         h = torch.cat([h, deriv, accel], dim=1)
         for block in self.blocks:
-            if use_checkpoint and h.requires_grad:
-                h = checkpoint(block, h)
+            if use_checkpoint:
+                h = checkpoint(block, h, use_reentrant=False)
             else:
                 h = block(h)
         return h
@@ -35,6 +35,42 @@ def make_predictor(
         raise ValueError(f"unknown predictor: {pred_name}")
 
 
+# Maps encoder names to factories taking (base_channels, cond_mult).
+ENCODERS = {
+    "wavegrad": lambda base_channels, cond_mult: WaveGradEncoder(
+        cond_mult=cond_mult, base_channels=base_channels
+    ),
+    "unet": lambda base_channels, cond_mult: UNetEncoder(
+        base_channels=base_channels, out_channels=base_channels * cond_mult
+    ),
+    # Like unet, but with downsample rate 128 rather than 256.
+    "unet128": lambda base_channels, cond_mult: UNetEncoder(
+        base_channels=base_channels,
+        channel_mult=(1, 1, 2, 2, 2, 4, 4, 8),
+        out_channels=base_channels * cond_mult,
+    ),
+    "unet128-dilated": lambda base_channels, cond_mult: UNetEncoder(
+        base_channels=base_channels,
+        channel_mult=(1, 1, 2, 2, 2, 4, 4, 8),
+        out_dilations=(4, 8, 16, 32),
+        out_channels=base_channels * cond_mult,
+    ),
+    "conv-mfcc-ulaw": lambda base_channels, cond_mult: ConvMFCCEncoder(
+        base_channels=base_channels, out_channels=base_channels * cond_mult
+    ),
+    "conv-mfcc-ulaw-v2": lambda base_channels, cond_mult: ConvMFCCEncoder(
+        base_channels=base_channels,
+        out_channels=base_channels * cond_mult,
+        version=2,
+    ),
+    "conv-mfcc-linear": lambda base_channels, cond_mult: ConvMFCCEncoder(
+        base_channels=base_channels,
+        out_channels=base_channels * cond_mult,
+        input_ulaw=False,
+    ),
+}
+
+
 def make_encoder(
     enc_name: str,
     base_channels: int = 32,
@@ -43,41 +79,6 @@ def make_encoder(
     """
     Create an Encoder model from a human-readable name.
     """
-    if enc_name == "wavegrad":
-        return WaveGradEncoder(cond_mult=cond_mult, base_channels=base_channels)
-    elif enc_name == "unet":
-        return UNetEncoder(
-            base_channels=base_channels, out_channels=base_channels * cond_mult
-        )
-    elif enc_name == "unet128":
-        # Like unet, but with downsample rate 128 rather than 256.
-        return UNetEncoder(
-            base_channels=base_channels,
-            channel_mult=(1, 1, 2, 2, 2, 4, 4, 8),
-            out_channels=base_channels * cond_mult,
-        )
-    elif enc_name == "unet128-dilated":
-        return UNetEncoder(
-            base_channels=base_channels,
-            channel_mult=(1, 1, 2, 2, 2, 4, 4, 8),
-            out_dilations=(4, 8, 16, 32),
-            out_channels=base_channels * cond_mult,
-        )
-    elif enc_name == "conv-mfcc-ulaw":
-        return ConvMFCCEncoder(
-            base_channels=base_channels, out_channels=base_channels * cond_mult
-        )
-    elif enc_name == "conv-mfcc-ulaw-v2":
-        return ConvMFCCEncoder(
-            base_channels=base_channels,
-            out_channels=base_channels * cond_mult,
-            version=2,
-        )
-    elif enc_name == "conv-mfcc-linear":
-        return ConvMFCCEncoder(
-            base_channels=base_channels,
-            out_channels=base_channels * cond_mult,
-            input_ulaw=False,
-        )
-    else:
+    if enc_name not in ENCODERS:
         raise ValueError(f"unknown encoder: {enc_name}")
+    return ENCODERS[enc_name](base_channels=base_channels, cond_mult=cond_mult)
@@ -0,0 +1,17 @@
+import pytest
+import torch
+
+from .make import make_predictor
+
+
+@pytest.mark.parametrize("pred_name", ["unet", "wavegrad"])
+def test_predictor_condition(pred_name: str):
+    model = make_predictor(pred_name, base_channels=8, cond_channels=16, num_labels=3)
+    x = torch.randn(2, 1, 512)
+    ts = torch.rand(2)
+    cond = torch.randn(2, 16, 512 // model.downsample_rate)
+    labels = torch.tensor([0, 2])
+    with torch.no_grad():
+        expected = model(x, ts, cond=cond, labels=labels)
+        actual = model.condition(cond=cond, labels=labels)(x, ts)
+    assert torch.allclose(actual, expected)
@@ -2,7 +2,8 @@
 Adapted from https://github.com/openai/guided-diffusion/blob/b16b0a180ffac9da8a6a03f1e78de8e96669eee8/guided_diffusion/unet.py.
 """
 
-from typing import List, Optional, Tuple
+import functools
+from typing import Callable, List, Optional, Tuple
 
 import torch
 import torch.nn as nn
@@ -123,31 +124,54 @@ class UNetPredictor(Predictor):
         labels: Optional[torch.Tensor] = None,
         use_checkpoint: bool = False,
     ) -> torch.Tensor:
-        assert (labels is None) == (
-            self.num_labels is None
-        ), "must provide labels if and only if model is class conditional"
         assert (cond is None) == (
             self.cond_channels is None
         ), "must provide cond sequence if and only if model is conditional"
+        return self._forward(
+            x,
+            ts,
+            cond_proj=None if cond is None else self.cond_proj(cond),
+            labels=labels,
+            use_checkpoint=use_checkpoint,
+        )
+
+    def condition(self, cond: Optional[torch.Tensor] = None, **kwargs) -> Callable:
+        if cond is None:
+            return super().condition(**kwargs)
+        assert self.cond_channels is not None, "model is not conditional"
+        cond_proj = self.cond_proj(cond)
+        return functools.partial(self._forward, cond_proj=cond_proj, **kwargs)
+
+    def _forward(
+        self,
+        x: torch.Tensor,
+        ts: torch.Tensor,
+        cond_proj: Optional[torch.Tensor] = None,
+        labels: Optional[torch.Tensor] = None,
+        use_checkpoint: bool = False,
+    ) -> torch.Tensor:
+        assert (labels is None) == (
+            self.num_labels is None
+        ), "must provide labels if and only if model is class conditional"
 
         emb = self.time_embed_extra(self.time_embed(ts))
         if labels is not None:
             emb = emb + self.class_embed(labels)
 
         h = self.in_conv(x)
-        if cond is not None:
-            h = h + F.interpolate(self.cond_proj(cond), h.shape[-1])
+        if cond_proj is not None:
+            h = h + F.interpolate(cond_proj, h.shape[-1])
 
         skips = [h]
         for block in self.down_blocks:
             if use_checkpoint:
-                h = checkpoint(block, h, emb)
+                h = checkpoint(block, h, emb, use_reentrant=False)
             else:
                 h = block(h, emb)
             skips.append(h)
         for block in self.middle_blocks:
             if use_checkpoint:
-                h = checkpoint(block, h, emb)
+                h = checkpoint(block, h, emb, use_reentrant=False)
             else:
                 h = block(h, emb)
         for i, block in enumerate(self.up_blocks):
@@ -155,7 +179,7 @@ class UNetPredictor(Predictor):
             if i % (self.depth_mult + 2) != self.depth_mult + 1:
                 h = torch.cat([h, skips.pop()], axis=1)
             if use_checkpoint:
-                h = checkpoint(block, h, emb)
+                h = checkpoint(block, h, emb, use_reentrant=False)
             else:
                 h = block(h, emb)
 
@@ -234,7 +258,7 @@ class UNetEncoder(Encoder):
         h = self.in_conv(x)
         for block in self.blocks:
             if use_checkpoint:
-                h = checkpoint(block, h)
+                h = checkpoint(block, h, use_reentrant=False)
             else:
                 h = block(h)
         h = self.out(h)
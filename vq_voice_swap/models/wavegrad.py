@@ -3,8 +3,9 @@ A model similar to that in GAN-TTS (https://arxiv.org/abs/1909.11646v2)
 and WaveGrad (https://arxiv.org/abs/2009.00713).
 """
 
+import functools
 import math
-from typing import List, Optional
+from typing import Callable, List, Optional
 
 import torch
 import torch.nn as nn
@@ -86,31 +87,47 @@ class WaveGradPredictor(Predictor):
         labels: Optional[torch.Tensor] = None,
         use_checkpoint=False,
     ) -> torch.Tensor:
-        assert x.shape[2] % 64 == 0, "timesteps must be divisible by 64"
-
         # Model doesn't need to be conditional
         if cond is None:
             cond = torch.zeros(x.shape[0], self.cond_channels, x.shape[2] // 64).to(x)
 
+        return self._forward(
+            x, t, self.u_conv_1(cond), labels=labels, use_checkpoint=use_checkpoint
+        )
+
+    def condition(self, cond: Optional[torch.Tensor] = None, **kwargs) -> Callable:
+        if cond is None:
+            return super().condition(**kwargs)
+        return functools.partial(self._forward, u_input=self.u_conv_1(cond), **kwargs)
+
+    def _forward(
+        self,
+        x: torch.Tensor,
+        t: torch.Tensor,
+        u_input: torch.Tensor,
+        labels: Optional[torch.Tensor] = None,
+        use_checkpoint=False,
+    ) -> torch.Tensor:
+        assert x.shape[2] % 64 == 0, "timesteps must be divisible by 64"
+
         d_outputs = []
         d_input = x
         for block in self.d_blocks:
             if use_checkpoint:
-                if not d_input.requires_grad:
-                    d_input = d_input.clone().requires_grad_(True)
-                d_input = checkpoint(block, d_input)
+                d_input = checkpoint(block, d_input, use_reentrant=False)
             else:
                 d_input = block(d_input)
             d_outputs.append(d_input)
 
-        u_input = self.u_conv_1(cond)
         for block in self.u_blocks:
 
             def run_fn(u_input, d_output, block=block, t=t, labels=labels):
                 return block(u_input, d_output, t, labels=labels)
 
             if use_checkpoint:
-                u_input = checkpoint(run_fn, u_input, d_outputs.pop())
+                u_input = checkpoint(
+                    run_fn, u_input, d_outputs.pop(), use_reentrant=False
+                )
             else:
                 u_input = run_fn(u_input, d_outputs.pop())
         out = self.u_ln(u_input)
@@ -149,9 +166,9 @@ class WaveGradEncoder(Encoder):
 
     def forward(self, x: torch.Tensor, use_checkpoint: bool = False) -> torch.Tensor:
         if use_checkpoint:
-            if not x.requires_grad:
-                x = x.clone().requires_grad_()
-            return checkpoint_sequential(self.d_blocks, len(self.d_blocks), x)
+            return checkpoint_sequential(
+                self.d_blocks, len(self.d_blocks), x, use_reentrant=False
+            )
         else:
             return self.d_blocks(x)
 
@@ -328,9 +345,8 @@ class FILM(nn.Module):
         assert (labels is None) == (self.label_emb is None)
         if labels is not None:
             embedding = embedding + self.label_emb(labels)
-        while len(embedding.shape) < len(cond.shape):
-            embedding = embedding[..., None]
-        embedding = embedding + self.cond_emb(cond)
+        # Broadcast the [N x C] embedding over time in the [N x C x T] cond.
+        embedding = embedding[..., None] + self.cond_emb(cond)
         alpha_beta = self.out_layer(embedding)
         alpha, beta = torch.split(alpha_beta, self.out_channels, dim=1)
         return inputs * (1 + alpha) + beta
@@ -1,12 +1,15 @@
 import argparse
+import inspect
 import json
 import os
 import sys
+import threading
 import time
 from abc import ABC, abstractmethod
 from typing import Any, Dict, Iterable, List, Set, Tuple
 
 import torch
+import torch.distributed as dist
 import torch.nn as nn
 import torch.nn.functional as F
 from torch.optim import AdamW
@@ -19,8 +22,8 @@ from .diffusion_model import DiffusionModel
 from .ema import ModelEMA
 from .logger import Logger
 from .loss_tracker import LossTracker
-from .models import Classifier, EncoderPredictor, Savable
-from .util import count_params, repeat_dataset
+from .models import Classifier, EncoderPredictor, Savable, atomic_save, state_to_cpu
+from .util import BatchPrefetcher, count_params, repeat_dataset
 from .vq import ReviveVQLoss, StandardVQLoss
 from .vq_vae import VQVAE
 
@@ -35,33 +38,89 @@ class TrainLoop(ABC):
         if args is None:
             args = self.arg_parser().parse_args()
         self.args = args
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.rank, self.world_size, self.device = self.setup_distributed()
+        if self.device.type == "cuda":
+            # Training windows have a fixed length, so the fastest conv
+            # algorithms found on the first step can be reused.
+            torch.backends.cudnn.benchmark = True
 
-        if not os.path.exists(args.output_dir):
+        if self.is_root and not os.path.exists(args.output_dir):
             os.mkdir(args.output_dir)
 
         self.data_loader, self.num_labels = self.create_data_loader()
         self.model, self.resume = self.create_model()
         self.model.to(self.device)
+        self.broadcast_model()
 
         self.emas = self.create_emas()
         self.opt = self.create_opt()
+        self.grad_scaler = self.create_grad_scaler()
         self.logger, self.tracker = self.create_logger_tracker()
 
         self.total_steps = self.logger.start_step
         self.loop_steps = 0
+        self.save_thread = None
+        self.save_error = None
+        self.save_step = None
 
         self.freeze_parameters(self.frozen_parameters())
-        self.write_run_info()
+        if self.args.compile:
+            if not hasattr(nn.Module, "compile"):
+                sys.exit(
+                    f"error: --compile requires PyTorch 2.2 or newer "
+                    f"(found {torch.__version__})"
+                )
+            for module in self.compiled_modules():
+                # Compile in-place, so that state_dict() keys are unchanged.
+                module.compile(dynamic=False)
+        if self.is_root:
+            self.write_run_info()
+
+    @property
+    def is_root(self) -> bool:
+        return self.rank == 0
+
+    def setup_distributed(self) -> Tuple[int, int, torch.device]:
+        """
+        Join the process group if launched with torchrun, and pick a device.
+
+        :return: a tuple (rank, world_size, device).
+        """
+        world_size = int(os.environ.get("WORLD_SIZE", "1"))
+        if world_size == 1:
+            device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+            return 0, 1, device
+        if torch.cuda.is_available():
+            local_rank = int(os.environ["LOCAL_RANK"])
+            torch.cuda.set_device(local_rank)
+            device = torch.device("cuda", local_rank)
+            dist.init_process_group("nccl")
+        else:
+            device = torch.device("cpu")
+            dist.init_process_group("gloo")
+        return dist.get_rank(), world_size, device
+
+    def broadcast_model(self):
+        """
+        Make sure every process starts from the root process's parameters.
+        """
+        if self.world_size == 1:
+            return
+        for tensor in self.model.state_dict().values():
+            dist.broadcast(tensor, src=0)
 
     def loop(self):
-        for i, data_batch in enumerate(repeat_dataset(self.data_loader)):
-            self.total_steps = i + self.logger.start_step
-            self.loop_steps = i
-            self.step(data_batch)
+        batches = BatchPrefetcher(repeat_dataset(self.data_loader), self.device)
+        try:
+            for i, data_batch in enumerate(batches):
+                self.total_steps = i + self.logger.start_step
+                self.loop_steps = i
+                self.step(data_batch)
+        finally:
+            self.wait_for_save()
 
     def step(self, data_batch: Dict[str, torch.Tensor]):
-        self.opt.zero_grad()
+        self.opt.zero_grad(set_to_none=True)
 
         all_losses = []
         all_ts = []
@@ -69,7 +128,8 @@ class TrainLoop(ABC):
         all_extra = dict()
 
         for microbatch, weight in self.split_microbatches(data_batch):
-            losses, ts, extra_losses = self.compute_losses(microbatch)
+            with torch.autocast("cuda", enabled=self.args.fp16):
+                losses, ts, extra_losses = self.compute_losses(microbatch)
 
             # Re-weighted losses for microbatch averaging
             extra_losses = {k: v * weight for k, v in extra_losses.items()}
@@ -88,12 +148,14 @@ class TrainLoop(ABC):
                 k: v.detach() + all_extra.get(k, 0.0) for k, v in extra_losses.items()
             }
 
+        self.sync_gradients()
         self.step_optimizer()
         self.log_losses(
             all_loss, torch.cat(all_losses, dim=0), torch.cat(all_ts, dim=0), all_extra
         )
 
-        if (self.total_steps + 1) % self.args.save_interval == 0:
+        self.poll_save()
+        if self.is_root and (self.total_steps + 1) % self.args.save_interval == 0:
             self.save()
 
     def split_microbatches(
@@ -111,11 +173,40 @@ class TrainLoop(ABC):
             res.append((sub_batch, len(sub_batch[key]) / batch_size))
         return res
 
+    def sync_gradients(self):
+        """
+        Average gradients across processes in a single all-reduce.
+
+        The models compute losses through methods other than forward(), so
+        we cannot rely on DistributedDataParallel hooks to do this for us.
+
+        Parameters without a gradient get a zero gradient, since a parameter
+        may only be used by some of the processes, and every process must
+        all-reduce tensors of the same size.
+        """
+        if self.world_size == 1:
+            return
+        grads = []
+        for p in self.model.parameters():
+            if not p.requires_grad:
+                continue
+            if p.grad is None:
+                p.grad = torch.zeros_like(p)
+            grads.append(p.grad)
+        if not grads:
+            return
+        flat_grads = torch.cat([g.flatten() for g in grads])
+        dist.all_reduce(flat_grads)
+        flat_grads /= self.world_size
+        for grad, synced in zip(grads, flat_grads.split([g.numel() for g in grads])):
+            grad.copy_(synced.view_as(grad))
+
     def loss_backward(self, loss: torch.Tensor):
-        loss.backward()
+        self.grad_scaler.scale(loss).backward()
 
     def step_optimizer(self):
-        self.opt.step()
+        self.grad_scaler.step(self.opt)
+        self.grad_scaler.update()
         for ema in self.emas.values():
             ema.update()
 
@@ -127,6 +218,8 @@ class TrainLoop(ABC):
         Compute loss per batch element, and also return the diffusion timestep
         for each loss. Also return a (possibly empty) dict of other losses.
 
+        The batch has already been moved to self.device by loop().
+
         :return: a tuple (losses, ts, other).
         """
 
@@ -137,23 +230,81 @@ class TrainLoop(ABC):
         ts: torch.Tensor,
         extra_losses: Dict[str, torch.Tensor],
     ):
+        if not self.is_root:
+            return
+
+        # Copy everything to the CPU at once, rather than synchronizing with
+        # the device separately for every logged value.
+        keys = list(extra_losses.keys())
+        scalars = torch.stack([loss, *(extra_losses[k] for k in keys)]).float()
+        values = torch.cat([scalars, ts.float(), losses.float()]).cpu()
+        scalars, ts, losses = values.split([len(scalars), len(ts), len(losses)])
+
         self.tracker.add(ts, losses)
-        other = {k: v.item() for k, v in extra_losses.items()}
+        scalars = scalars.tolist()
+        other = dict(zip(keys, scalars[1:]))
         other.update(self.tracker.log_dict())
-        self.logger.log(self.loop_steps + 1, loss=loss.item(), **other)
+        self.logger.log(self.loop_steps + 1, loss=scalars[0], **other)
 
     def save(self):
-        self.model.save(self.checkpoint_path())
+        """
+        Save checkpoints in a background thread.
+
+        States are copied to the CPU before this returns, so training may
+        continue to update the model while the files are being written.
+        The save is marked in the log (with this step) by the main thread once
+        every file has been written.
+        """
+        # Only allow one outstanding save at a time.
+        self.wait_for_save()
+        self.save_step = self.total_steps + 1
+        states = [(self.model.save_dict(), self.checkpoint_path())]
         for rate, ema in self.emas.items():
-            ema.model.save(self.ema_path(rate))
-        torch.save(self.opt.state_dict(), self.opt_path())
-        self.logger.mark_save()
+            states.append((ema.model.save_dict(), self.ema_path(rate)))
+        states.append((self.opt.state_dict(), self.opt_path()))
+        if self.grad_scaler.is_enabled():
+            states.append((self.grad_scaler.state_dict(), self.grad_scaler_path()))
+        states = [(state_to_cpu(state), path) for state, path in states]
+        self.save_thread = threading.Thread(target=self._write_states, args=(states,))
+        self.save_thread.start()
+
+    def poll_save(self):
+        """
+        Finish the outstanding save if its thread is done, without blocking.
+        """
+        if self.save_thread is not None and not self.save_thread.is_alive():
+            self.wait_for_save()
+
+    def wait_for_save(self):
+        """
+        Wait for the outstanding save (if any) to finish, and either mark it
+        in the log or re-raise the error that it encountered.
+        """
+        if self.save_thread is None:
+            return
+        self.save_thread.join()
+        self.save_thread = None
+        if self.save_error is not None:
+            err, self.save_error = self.save_error, None
+            raise err
+        # Only mark the save once every file is completely written.
+        self.logger.mark_save(self.save_step)
+
+    def _write_states(self, states: List[Tuple[Any, str]]):
+        try:
+            for state, path in states:
+                atomic_save(state, path)
+        except Exception as exc:
+            self.save_error = exc
 
     def create_data_loader(self) -> Tuple[Iterable, int]:
         return create_data_loader(
             directory=self.args.data_dir,
             batch_size=self.args.batch_size,
             encoding=self.args.encoding,
+            num_workers=self.args.num_workers,
+            pin_memory=self.device.type == "cuda",
+            distributed=self.world_size > 1,
         )
 
     def create_model(self) -> Tuple[Savable, bool]:
@@ -187,19 +338,46 @@ class TrainLoop(ABC):
         return res
 
     def create_opt(self) -> torch.optim.Optimizer:
+        opt_kwargs = dict()
+        if self.device.type == "cuda":
+            # Update all parameters with a single multi-tensor kernel rather
+            # than a per-parameter loop, if this PyTorch version supports it.
+            opt_params = inspect.signature(AdamW).parameters
+            if "fused" in opt_params:
+                opt_kwargs["fused"] = True
+            elif "foreach" in opt_params:
+                opt_kwargs["foreach"] = True
         opt = AdamW(
             self.model.parameters(),
             lr=self.args.lr,
             weight_decay=self.args.weight_decay,
+            **opt_kwargs,
         )
         if os.path.exists(self.opt_path()):
             print("loading optimizer from checkpoint...")
             opt.load_state_dict(torch.load(self.opt_path(), map_location="cpu"))
         return opt
 
+    def create_grad_scaler(self) -> torch.amp.GradScaler:
+        scaler = torch.amp.GradScaler("cuda", enabled=self.args.fp16)
+        if scaler.is_enabled() and os.path.exists(self.grad_scaler_path()):
+            print("loading grad scaler from checkpoint...")
+            scaler.load_state_dict(torch.load(self.grad_scaler_path()))
+        return scaler
+
     def frozen_parameters(self) -> Set[nn.Parameter]:
         return set()
 
+    def compiled_modules(self) -> List[nn.Module]:
+        """
+        Get the modules to compile with --compile.
+
+        Compiling only wraps a module's __call__, so these must be modules
+        that are called during compute_losses(), rather than modules whose
+        other methods (e.g. losses()) are used.
+        """
+        return [self.model]
+
     def freeze_parameters(self, params: Set[nn.Parameter]):
         param_to_idx = {param: idx for idx, param in enumerate(self.model.parameters())}
         count = 0
@@ -225,7 +403,17 @@ class TrainLoop(ABC):
             opt_state["state"][idx]["exp_avg_sq"].zero_()
 
     def create_logger_tracker(self) -> Tuple[Logger, LossTracker]:
-        return Logger(self.log_path(), resume=self.resume), LossTracker()
+        if self.is_root:
+            logger = Logger(self.log_path(), resume=self.resume)
+        else:
+            # Only the root process writes the log, but every process needs
+            # to know which step we are resuming from.
+            logger = Logger(os.devnull)
+        if self.world_size > 1:
+            start_step = [logger.start_step]
+            dist.broadcast_object_list(start_step, src=0)
+            logger.start_step = start_step[0]
+        return logger, LossTracker()
 
     def checkpoint_path(self):
         return os.path.join(self.args.output_dir, "model.pt")
@@ -236,6 +424,9 @@ class TrainLoop(ABC):
     def opt_path(self):
         return os.path.join(self.args.output_dir, "opt.pt")
 
+    def grad_scaler_path(self):
+        return os.path.join(self.args.output_dir, "grad_scaler.pt")
+
     def log_path(self):
         return os.path.join(self.args.output_dir, "train_log.txt")
 
@@ -279,12 +470,20 @@ class TrainLoop(ABC):
         parser.add_argument("--ema-rate", default="0.9999", type=str)
         parser.add_argument("--weight-decay", default=0.0, type=float)
         parser.add_argument("--batch-size", default=8, type=int)
-        parser.add_argument("--microbatch", default=None, type=int)
+        parser.add_argument(
+            "--microbatch",
+            default=None,
+            type=int,
+            help="accumulate gradients over microbatches of this size",
+        )
         parser.add_argument("--output-dir", default=cls.default_output_dir(), type=str)
         parser.add_argument("--pretrained-path", default=None, type=str)
         parser.add_argument("--save-interval", default=1000, type=int)
         parser.add_argument("--grad-checkpoint", action="store_true")
+        parser.add_argument("--fp16", action="store_true")
+        parser.add_argument("--compile", action="store_true")
         parser.add_argument("--encoding", default="linear", type=str)
+        parser.add_argument("--num-workers", default=4, type=int)
         parser.add_argument("data_dir", type=str)
         return parser
 
@@ -300,9 +499,9 @@ class DiffusionTrainLoop(TrainLoop):
     def compute_losses(
         self, data_batch: Dict[str, torch.Tensor]
     ) -> Tuple[torch.Tensor, torch.Tensor, Dict[str, torch.Tensor]]:
-        audio_seq = data_batch["samples"][:, None].to(self.device)
+        audio_seq = data_batch["samples"][:, None]
         if self.args.class_cond:
-            extra_kwargs = dict(labels=data_batch["label"].to(self.device))
+            extra_kwargs = dict(labels=data_batch["label"])
         else:
             extra_kwargs = dict()
         ts = torch.rand(len(audio_seq), device=self.device)
@@ -318,6 +517,9 @@ class DiffusionTrainLoop(TrainLoop):
     def model_class(self) -> Any:
         return DiffusionModel
 
+    def compiled_modules(self) -> List[nn.Module]:
+        return [self.model.predictor]
+
     def create_new_model(self) -> Savable:
         return self.model_class()(
             pred_name=self.args.predictor,
@@ -355,9 +557,9 @@ class VQVAETrainLoop(DiffusionTrainLoop):
     def compute_losses(
         self, data_batch: Dict[str, torch.Tensor]
     ) -> Tuple[torch.Tensor, torch.Tensor, Dict[str, torch.Tensor]]:
-        audio_seq = data_batch["samples"][:, None].to(self.device)
+        audio_seq = data_batch["samples"][:, None]
         if self.args.class_cond:
-            extra_kwargs = dict(labels=data_batch["label"].to(self.device))
+            extra_kwargs = dict(labels=data_batch["label"])
         else:
             extra_kwargs = dict()
         losses = self.model.losses(
@@ -397,6 +599,9 @@ class VQVAETrainLoop(DiffusionTrainLoop):
             res.update(self.model.vq.parameters())
         return res
 
+    def compiled_modules(self) -> List[nn.Module]:
+        return [self.model.encoder, self.model.predictor]
+
     @classmethod
     def arg_parser(cls) -> argparse.ArgumentParser:
         parser = super().arg_parser()
@@ -425,7 +630,18 @@ class VQVAETrainLoop(DiffusionTrainLoop):
     def step_optimizer(self):
         super().step_optimizer()
         if self.should_revive():
-            self.model.vq.revive_dead_entries()
+            vq = self.model.vq
+            if self.world_size == 1:
+                vq.revive_dead_entries()
+                return
+            # An entry is only dead if no process has used it. The counts are
+            # then identical on every process, so they all agree on whether
+            # any entry will be revived.
+            dist.all_reduce(vq.usage_count, op=dist.ReduceOp.MAX)
+            if (vq.usage_count == 0).any().item():
+                vq.revive_dead_entries()
+                # Revival samples from each process's own batch.
+                dist.broadcast(vq.dictionary.data, src=0)
 
     def should_revive(self) -> bool:
         return not self.args.revival_coeff and not self.args.freeze_vq
@@ -497,11 +713,14 @@ class VQVAEUncondTrainLoop(VQVAETrainLoop):
     def compute_losses(
         self, data_batch: Dict[str, torch.Tensor]
     ) -> Tuple[torch.Tensor, torch.Tensor, Dict[str, torch.Tensor]]:
-        label_mask = torch.rand(data_batch["label"].shape) > self.args.no_class_prob
+        label_mask = (
+            torch.rand(data_batch["label"].shape, device=self.device)
+            > self.args.no_class_prob
+        )
         labels = (data_batch["label"] + 1) * label_mask
 
-        audio_seq = data_batch["samples"][:, None].to(self.device)
-        extra_kwargs = dict(labels=labels.to(self.device))
+        audio_seq = data_batch["samples"][:, None]
+        extra_kwargs = dict(labels=labels)
         losses = self.model.losses(
             self.vq_loss,
             audio_seq,
@@ -551,8 +770,8 @@ class ClassifierTrainLoop(TrainLoop):
     def compute_losses(
         self, data_batch: Dict[str, torch.Tensor]
     ) -> Tuple[torch.Tensor, torch.Tensor, Dict[str, torch.Tensor]]:
-        audio_seq = data_batch["samples"][:, None].to(self.device)
-        labels = data_batch["label"].to(self.device)
+        audio_seq = data_batch["samples"][:, None]
+        labels = data_batch["label"]
         ts = self.sample_timesteps(len(audio_seq))
 
         samples = self.diffusion.sample_q(audio_seq, ts)
@@ -602,7 +821,7 @@ class EncoderPredictorTrainLoop(TrainLoop):
     def compute_losses(
         self, data_batch: Dict[str, torch.Tensor]
     ) -> Tuple[torch.Tensor, torch.Tensor, Dict[str, torch.Tensor]]:
-        audio_seq = data_batch["samples"][:, None].to(self.device)
+        audio_seq = data_batch["samples"][:, None]
         ts = self.sample_timesteps(len(audio_seq))
         with torch.no_grad():
             targets = self.vq_vae.encode(audio_seq)
@@ -623,6 +842,9 @@ class EncoderPredictorTrainLoop(TrainLoop):
     def model_class(self) -> Any:
         return EncoderPredictor
 
+    def compiled_modules(self) -> List[nn.Module]:
+        return [self.model.unet]
+
     def create_model(self) -> Tuple[Savable, bool]:
         self.vq_vae = VQVAE.load(self.args.vq_vae_path).to(self.device)
         return super().create_model()
@@ -1,11 +1,71 @@
-from typing import Iterable, Iterator
+from typing import Any, Dict, Iterable, Iterator, Optional
 
+import torch
 import torch.nn as nn
 
 
 def repeat_dataset(data_loader: Iterable) -> Iterator:
+    epoch = 0
     while True:
+        # Distributed samplers must be told the epoch to re-shuffle.
+        sampler = getattr(data_loader, "sampler", None)
+        if hasattr(sampler, "set_epoch"):
+            sampler.set_epoch(epoch)
         yield from data_loader
+        epoch += 1
+
+
+class BatchPrefetcher:
+    """
+    Wrap an iterable of batch dicts and move each batch to a device.
+
+    On CUDA, batches are copied on a side stream, so the copy of the next
+    batch overlaps with computation on the current one.
+
+    :param loader: an iterable of dicts mapping keys to Tensors.
+    :param device: the device to move batches to.
+    """
+
+    def __init__(self, loader: Iterable[Dict[str, Any]], device: torch.device):
+        self.loader = loader
+        self.device = device
+        self.stream = None
+        if device.type == "cuda":
+            self.stream = torch.cuda.Stream(device=device)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        loader_iter = iter(self.loader)
+        next_batch = self._preload(loader_iter)
+        while next_batch is not None:
+            batch = next_batch
+            if self.stream is not None:
+                cur_stream = torch.cuda.current_stream(self.device)
+                cur_stream.wait_stream(self.stream)
+                for v in batch.values():
+                    if isinstance(v, torch.Tensor):
+                        # The tensor was allocated on the side stream, so we
+                        # must tell the allocator it is used on this one.
+                        v.record_stream(cur_stream)
+            next_batch = self._preload(loader_iter)
+            yield batch
+
+    def _preload(self, loader_iter: Iterator) -> Optional[Dict[str, Any]]:
+        try:
+            batch = next(loader_iter)
+        except StopIteration:
+            return None
+        if self.stream is None:
+            return self._to_device(batch)
+        with torch.cuda.stream(self.stream):
+            return self._to_device(batch)
+
+    def _to_device(self, batch: Dict[str, Any]) -> Dict[str, Any]:
+        res = {}
+        for k, v in batch.items():
+            if isinstance(v, torch.Tensor):
+                v = v.to(self.device, non_blocking=True)
+            res[k] = v
+        return res
 
 
 def count_params(model: nn.Module) -> int:
@@ -127,8 +127,7 @@ class VQ(nn.Module):
         idxs_shape = (inputs.shape[0], *inputs.shape[2:])
         x, unflatten_fn = flatten_channels(inputs)
 
-        diffs = embedding_distances(self.dictionary, x)
-        idxs = torch.argmin(diffs, dim=-1)
+        idxs = nearest_embeddings(self.dictionary, x)
         embedded = self.embed(idxs)
         passthrough = embedded.detach() + (x - x.detach())
 
@@ -221,6 +220,26 @@ def embedding_distances(dictionary: torch.Tensor, tensor: torch.Tensor) -> torch
     return -2 * dots + dict_norms + tensor_norms[..., None]
 
 
+def nearest_embeddings(dictionary: torch.Tensor, tensor: torch.Tensor) -> torch.Tensor:
+    """
+    Find the index of the closest dictionary entry to every vector.
+
+    This computes the search as a single matrix multiply without tracking
+    gradients. It is always done in float32, even under autocast, since
+    rounding errors in half precision are large enough to change the argmin.
+
+    :param dictionary: a [D x C] Tensor.
+    :param tensor: a [N x C] Tensor.
+    :return: an [N] integer Tensor of indices.
+    """
+    with torch.no_grad(), torch.autocast(tensor.device.type, enabled=False):
+        dictionary = dictionary.float()
+        dict_norms = torch.sum(torch.pow(dictionary, 2), dim=-1)
+        # The norm of each input vector does not affect the argmin.
+        diffs = torch.addmm(dict_norms, tensor.float(), dictionary.t(), alpha=-2)
+        return torch.argmin(diffs, dim=-1)
+
+
 def flatten_channels(
     x: torch.Tensor,
 ) -> Tuple[torch.Tensor, Callable[[torch.Tensor], torch.Tensor]]:
@@ -0,0 +1,11 @@
+import torch
+
+from .vq import embedding_distances, nearest_embeddings
+
+
+def test_nearest_embeddings():
+    dictionary = torch.randn(64, 16)
+    inputs = torch.randn(200, 16) * 3
+    actual = nearest_embeddings(dictionary, inputs)
+    expected = embedding_distances(dictionary, inputs).argmin(-1)
+    assert (actual == expected).all()
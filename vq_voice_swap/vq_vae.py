@@ -1,10 +1,12 @@
+import math
 from typing import Any, Dict, Optional
 
 import torch
 
+from .diffusion import mse_per_sample
 from .diffusion_model import DiffusionModel
 from .models import EncoderPredictor, make_encoder
-from .vq import VQ, VQLoss
+from .vq import VQ, VQLoss, flatten_channels, nearest_embeddings
 
 
 class VQVAE(DiffusionModel):
@@ -30,6 +32,7 @@ class VQVAE(DiffusionModel):
         self.dictionary_size = dictionary_size
         self.encoder = encoder
         self.vq = VQ(self.cond_channels, dictionary_size)
+        self._noise_buf = None
 
     def losses(
         self,
@@ -54,31 +57,50 @@ class VQVAE(DiffusionModel):
                  - "ts": a 1-D float tensor of the timesteps per batch entry.
                  - "mses": a 1-D tensor of the mean MSE losses per batch entry.
         """
-        encoder_out = self.encoder(inputs, **extra_kwargs)
+        # Keep the VQ layer and its losses in full precision under autocast.
+        encoder_out = self.encoder(inputs, **extra_kwargs).float()
         if jitter:
             encoder_out = jitter_seq(encoder_out, jitter)
         vq_out = self.vq(encoder_out)
-        vq_loss = vq_loss(encoder_out, vq_out["embedded"], self.vq.dictionary)
+        with torch.autocast(inputs.device.type, enabled=False):
+            vq_loss = vq_loss(encoder_out, vq_out["embedded"], self.vq.dictionary)
 
-        ts = torch.rand(inputs.shape[0]).to(inputs)
-        epsilon = torch.randn_like(inputs)
+        ts = torch.rand(inputs.shape[0], dtype=inputs.dtype, device=inputs.device)
+        epsilon = self._sample_noise(inputs)
         noised_inputs = self.diffusion.sample_q(inputs, ts, epsilon=epsilon)
         cond = vq_out["passthrough"]
 
         if no_vq_prob:
-            cond_mask = (torch.rand(len(cond)) > no_vq_prob).to(cond)
-            while len(cond_mask.shape) < len(cond.shape):
-                cond_mask = cond_mask[..., None]
-            cond = cond * cond_mask
+            cond_mask = torch.rand(len(cond), device=cond.device) > no_vq_prob
+            cond = cond * cond_mask.to(cond)[:, None, None]
 
         predictions = self.predictor(
             noised_inputs, ts, cond=cond, labels=labels, **extra_kwargs
         )
-        mses = ((predictions - epsilon) ** 2).flatten(1).mean(1)
+        mses = mse_per_sample(predictions, epsilon)
         mse = mses.mean()
 
         return {"vq_loss": vq_loss, "mse": mse, "ts": ts, "mses": mses}
 
+    def _sample_noise(self, like: torch.Tensor) -> torch.Tensor:
+        """
+        Sample Gaussian noise shaped like a Tensor, re-using a buffer from the
+        previous call when possible to avoid a new allocation.
+
+        The result is overwritten by the next call, so it must not be saved
+        by autograd; losses() only uses it where no gradient flows.
+        """
+        buf = self._noise_buf
+        if (
+            buf is None
+            or buf.shape != like.shape
+            or buf.dtype != like.dtype
+            or buf.device != like.device
+        ):
+            buf = torch.empty_like(like)
+            self._noise_buf = buf
+        return buf.normal_()
+
     def encode(self, inputs: torch.Tensor) -> torch.Tensor:
         """
         Encode a waveform as discrete symbols.
@@ -86,8 +108,16 @@ class VQVAE(DiffusionModel):
         :param inputs: an [N x 1 x T] audio Tensor.
         :return: an [N x T1] Tensor of latent codes.
         """
-        with torch.no_grad():
-            return self.vq(self.encoder(inputs))["idxs"]
+        with torch.inference_mode():
+            encoder_out = self.encoder(inputs)
+            # Look up codes directly rather than through self.vq, which would
+            # store an inference tensor for revival in training mode.
+            flat_out, _ = flatten_channels(encoder_out)
+            idxs = nearest_embeddings(self.vq.dictionary, flat_out)
+            idxs = idxs.reshape(encoder_out.shape[0], *encoder_out.shape[2:])
+        # Inference tensors cannot be saved for backward, which happens when
+        # codes are embedded or used as classification targets.
+        return idxs.clone()
 
     def decode(
         self,
@@ -132,11 +162,11 @@ class VQVAE(DiffusionModel):
         x_T = torch.randn(
             codes.shape[0], 1, codes.shape[-1] * self.encoder.downsample_rate
         ).to(codes.device)
+        with torch.no_grad():
+            predictor = self.predictor.condition(cond=cond_seq, labels=labels)
         return self.diffusion.ddpm_sample(
             x_T,
-            lambda xs, ts, **kwargs: self.predictor(
-                xs, ts, cond=cond_seq, labels=labels, **kwargs
-            ),
+            predictor,
             steps=steps,
             progress=progress,
             constrain=constrain,
@@ -181,22 +211,26 @@ class VQVAE(DiffusionModel):
             codes.shape[0], 1, codes.shape[-1] * self.encoder.downsample_rate
         ).to(codes.device)
 
+        # The conditional prediction and each unconditional prediction used
+        # for guidance are computed together, in one batched predictor call.
+        cond_batch = cond_seq
+        label_batch = None if labels is None else labels + 1
+        if vq_scale:
+            cond_batch = torch.cat([cond_batch, torch.zeros_like(cond_seq)], dim=0)
+            if label_batch is not None:
+                label_batch = torch.cat([label_batch, labels + 1], dim=0)
+        if labels is not None and label_scale:
+            cond_batch = torch.cat([cond_batch, cond_seq], dim=0)
+            label_batch = torch.cat([label_batch, torch.zeros_like(labels)], dim=0)
+        num_branches = len(cond_batch) // len(cond_seq)
+        with torch.no_grad():
+            predictor = self.predictor.condition(cond=cond_batch, labels=label_batch)
+
         def pred_fn(xs, ts, **kwargs):
-            xs = torch.cat([xs] * 3, dim=0)
-            ts = torch.cat([ts] * 3, dim=0)
-            kwargs = {k: torch.cat([v] * 3, dim=0) for k, v in kwargs.items()}
-
-            cond_batch = cond_seq
-            label_batch = labels + 1
-
-            if vq_scale:
-                cond_batch = torch.cat([cond_batch, torch.zeros_like(cond_seq)], dim=0)
-                if label_batch is not None:
-                    label_batch = torch.cat([label_batch, labels + 1], dim=0)
-            if labels is not None and label_scale:
-                cond_batch = torch.cat([cond_batch, cond_seq], dim=0)
-                label_batch = torch.cat([label_batch, torch.zeros_like(labels)], dim=0)
-            outs = self.predictor(xs, ts, cond=cond_batch, labels=label_batch, **kwargs)
+            xs = torch.cat([xs] * num_branches, dim=0)
+            ts = torch.cat([ts] * num_branches, dim=0)
+            kwargs = {k: torch.cat([v] * num_branches) for k, v in kwargs.items()}
+            outs = predictor(xs, ts, **kwargs)
 
             base_pred = outs[: len(cond_seq)]
             outs = outs[len(cond_seq) :]
@@ -224,9 +258,8 @@ class VQVAE(DiffusionModel):
         """
         Get the minimum divisor required for input sequences.
         """
-        # Naive lowest common multiple.
         x, y = super().downsample_rate, self.encoder.downsample_rate
-        return next(i for i in range(x * y) if i % x == 0 and i % y == 0)
+        return x * y // math.gcd(x, y)
 
     def save_kwargs(self) -> Dict[str, Any]:
         res = super().save_kwargs()
@@ -252,7 +285,7 @@ def jitter_seq(seq: torch.Tensor, p: float) -> torch.Tensor:
     """
     right_shifted = torch.cat([seq[..., :1], seq[..., :-1]], dim=-1)
     left_shifted = torch.cat([seq[..., 1:], seq[..., -1:]], dim=-1)
-    nums = torch.rand(seq.shape[0], 1, seq.shape[-1]).to(seq.device)
+    nums = torch.rand(seq.shape[0], 1, seq.shape[-1], device=seq.device)
 
     return torch.where(
         nums < p / 2,
@@ -0,0 +1,61 @@
+from typing import Optional
+
+import pytest
+import torch
+
+from .vq_vae import VQVAE
+
+
+@pytest.mark.parametrize(
+    "num_labels,label_scale,vq_scale",
+    [
+        (3, 0.0, 1.0),
+        (3, 1.0, 0.0),
+        (3, 1.0, 1.0),
+        (None, 0.0, 1.0),
+    ],
+)
+def test_decode_uncond_guidance(
+    num_labels: Optional[int], label_scale: float, vq_scale: float
+):
+    model = VQVAE(
+        pred_name="unet",
+        base_channels=8,
+        cond_mult=2,
+        dictionary_size=4,
+        num_labels=num_labels,
+    )
+    codes = torch.randint(0, 4, size=(2, 2))
+    labels = None if num_labels is None else torch.tensor([0, 1])
+    samples = model.decode_uncond_guidance(
+        codes, labels=labels, steps=2, label_scale=label_scale, vq_scale=vq_scale
+    )
+    assert samples.shape == (2, 1, 2 * model.encoder.downsample_rate)
+    assert torch.isfinite(samples).all()
+
+
+@pytest.mark.parametrize("enc_name,expected", [("unet", 256), ("conv-mfcc-ulaw", 1280)])
+def test_downsample_rate(enc_name: str, expected: int):
+    model = VQVAE(
+        pred_name="unet",
+        enc_name=enc_name,
+        base_channels=8,
+        cond_mult=2,
+        dictionary_size=4,
+    )
+    # The conv-mfcc encoder (320) and UNet predictor (256) need their LCM.
+    assert model.downsample_rate == expected
+
+
+def test_encode_revive():
+    model = VQVAE(pred_name="unet", base_channels=8, cond_mult=2, dictionary_size=4)
+    inputs = torch.randn(2, 1, 512)
+    with torch.no_grad():
+        expected = model.vq(model.encoder(inputs))["idxs"]
+    actual = model.encode(inputs)
+    assert (actual == expected).all()
+
+    # Encoding must not leave state behind that breaks revival.
+    model.vq.usage_count.zero_()
+    model.vq.revive_dead_entries()
+    assert torch.isfinite(model.vq.dictionary).all()